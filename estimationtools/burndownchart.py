@@ -7,19 +7,25 @@
 # you should have received as part of this distribution.
 
 import copy
+from bisect import bisect_right
 from datetime import timedelta
-from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import compress, groupby
+from operator import itemgetter
+from string import Template
 
 from trac.core import TracError
+from trac.util import lazy
 from trac.util.datefmt import from_utimestamp
 from trac.util.html import html as tag
-from trac.util.text import unicode_quote, unicode_urlencode
+from trac.util.text import unicode_quote, unicode_quote_plus, \
+                           unicode_urlencode
 from trac.wiki.macros import WikiMacroBase
 from trac.wiki.api import parse_args
 
 from estimationtools.utils import parse_options, execute_query, \
-                                  get_closed_states, get_serverside_charts, \
-                                  EstimationToolsBase
+                                  iter_query, get_closed_states, \
+                                  get_serverside_charts, EstimationToolsBase
 
 DEFAULT_OPTIONS = {'width': '800', 'height': '200', 'color': 'ff9900',
                    'expected': '0', 'bgcolor': 'ffffff00',
@@ -27,6 +33,60 @@ DEFAULT_OPTIONS = {'width': '800', 'height': '200', 'color': 'ff9900',
                    'wecolor': 'ccccccaa', 'colorexpected': 'ffddaa',
                    'weekends': 'true', 'gridlines': '0'}
 
+# maximum number of tickets per ticket change history query
+CHANGES_CHUNK_SIZE = 500
+
+# maximum number of tickets whose change history is cached
+HISTORY_CACHE_SIZE = 4096
+
+# number of units per hour in which efforts are summed up
+EFFORT_UNITS = 1000000
+
+# maximum number of cached chart parameter templates
+CHART_TEMPLATES_SIZE = 64
+
+# chart parameter templates, by the options they depend on
+_chart_templates = {}
+
+
+def walk_ticket(deltas, change_idx, change_est, status_idx, status_open):
+    """Records the effort of a single ticket on the days it is open in
+    `deltas`, a list with one entry per day of the timetable plus one,
+    holding the change of the total effort from the previous day. The
+    running sum of `deltas` gives the total effort per day.
+
+    `change_idx` and `change_est` are parallel lists of the (ascending) day
+    offsets at which the effort changed and the new efforts, `status_idx` and
+    `status_open` are those for the status changes, with a flag whether the
+    ticket is open afterwards. Offsets may be negative for changes before
+    the first day of the timetable. The effort and status are constant
+    between two changes, so the lists are walked in parallel and each period
+    is recorded by its first day and the day after its end only.
+    """
+    n_days = len(deltas) - 1
+    n_changes = len(change_idx)
+    n_status = len(status_idx)
+    i = j = 0
+    estimate = None
+    is_open = False
+    day = min(change_idx[0], status_idx[0])
+    while day < n_days:
+        while i < n_changes and change_idx[i] <= day:
+            estimate = change_est[i]
+            i += 1
+        while j < n_status and status_idx[j] <= day:
+            is_open = status_open[j]
+            j += 1
+        # the period lasts until the next change (exclusive), or until the
+        # end of the timetable for changes after its last day
+        next_day = min(change_idx[i] if i < n_changes else n_days,
+                       status_idx[j] if j < n_status else n_days,
+                       n_days)
+        if is_open and estimate is not None and next_day > 0:
+            deltas[max(day, 0)] += estimate
+            deltas[next_day] -= estimate
+        day = next_day
+
 
 class BurndownChart(EstimationToolsBase, WikiMacroBase):
     """Creates burn down chart for selected tickets.
@@ -78,6 +138,14 @@ class BurndownChart(EstimationToolsBase, WikiMacroBase):
     closed_states = get_closed_states()
     serverside_charts = get_serverside_charts()
 
+    def __init__(self):
+        super(BurndownChart, self).__init__()
+        self._history_cache = {}
+
+    @lazy
+    def _closed_states(self):
+        return frozenset(self.closed_states)
+
     def expand_macro(self, formatter, name, content, args=None):
 
         # prepare options
@@ -93,37 +161,43 @@ class BurndownChart(EstimationToolsBase, WikiMacroBase):
             options['enddate'] = options['startdate'] + timedelta(days=1)
 
         # calculate data
-        timetable = self._calculate_timetable(options, query_args, req)
-        timetable_spent = self._calculate_timetable_spent(options, query_args, req)
-        
+        timetable, timetable_spent = self._calculate_timetables(options,
+                                                                query_args,
+                                                                req)
+        startdate = options['startdate']
+        dates = [startdate + timedelta(days=i)
+                 for i in range(len(timetable))]
+
         # remove weekends
         if not options['weekends']:
-            for date in timetable.keys():
-                if date.weekday() >= 5:
-                    del timetable[date]
-                    del timetable_spent[date]
+            start_weekday = startdate.weekday()
+            workdays = [(start_weekday + i) % 7 < 5
+                        for i in range(len(dates))]
+            dates = list(compress(dates, workdays))
+            timetable = list(compress(timetable, workdays))
+            timetable_spent = list(compress(timetable_spent, workdays))
 
         # scale data
-        xdata, ydata, maxhours = self._scale_data(timetable, options)
-        xdata_spent, ydata_spent, maxhours_spent = self._scale_data(timetable_spent, options)
+        xdata, ydata, maxhours = self._scale_data(timetable, dates, options)
+        xdata_spent, ydata_spent, maxhours_spent = \
+            self._scale_data(timetable_spent, dates, options)
         if not options['spent']:
             spentdata = "|0,0|0,0"
         else:
             spentdata = "|%s|%s" % (",".join(xdata_spent), ",".join(ydata_spent))
 
         # build html for google chart api
-        dates = sorted(timetable.keys())
         bottomaxis = "0:|" + "|".join([str(date.day) for date in dates]) + \
                      "|1:|%s/%s|%s/%s" % (dates[0].month, dates[0].year,
                                           dates[- 1].month, dates[- 1].year)
-        leftaxis = "2,0,%s" % maxhours
+        leftaxis = "2,0,%.15g" % maxhours
 
         # add line for expected progress
         if options['expected'] == '0':
             expecteddata = ""
         else:
             expecteddata = "|0,100|%s,0" % (
-                round(Decimal(options['expected']) * 100 / maxhours, 2))
+                round(float(options['expected']) * 100 / maxhours, 2))
 
         # prepare gridlines
         if options['gridlines'] == '0':
@@ -131,7 +205,7 @@ class BurndownChart(EstimationToolsBase, WikiMacroBase):
             gridlinesdata = "100.0,100.0,1,0"
         else:
             gridlinesdata = "%s,%s" % (xdata[1], (
-                round(Decimal(options['gridlines']) * 100 / maxhours, 4)))
+                round(float(options['gridlines']) * 100 / maxhours, 4)))
 
         # mark weekends
         weekends = []
@@ -163,19 +237,17 @@ class BurndownChart(EstimationToolsBase, WikiMacroBase):
         if title is None and options.get('milestone'):
             title = options['milestone'].split('|')[0]
 
-        chart_args = unicode_urlencode(
-                    {'chs': '%sx%s' % (options['width'], options['height']),
-                     'chf': 'c,s,%s|bg,s,00000000' % options['bgcolor'],
-                     'chd': 't:%s|%s%s%s' % (",".join(xdata), ",".join(ydata), spentdata, expecteddata),
-                     'cht': 'lxy',
-                     'chxt': 'x,x,y',
-                     'chxl': bottomaxis,
-                     'chxr': leftaxis,
-                     'chm': "|".join(weekends),
-                     'chg': gridlinesdata,
-                     'chco': '%s,%s,%s' % (options['color'], options['colorspent'], options['colorexpected']),
-                     'chdl': 'Remaining|Spent|Estimated',
-                     'chtt': title})
+        def quote(value):
+            return unicode_quote_plus(value, '')
+
+        chart_args = self._chart_template(options).substitute(
+            chtt=quote(title),
+            chd=quote('t:%s|%s%s%s' % (",".join(xdata), ",".join(ydata),
+                                       spentdata, expecteddata)),
+            chxl=quote(bottomaxis),
+            chxr=quote(leftaxis),
+            chg=quote(gridlinesdata),
+            chm=quote("|".join(weekends)))
         self.log.debug("BurndownChart data: %s", chart_args)
         if self.serverside_charts:
             return tag.image(
@@ -187,236 +259,297 @@ class BurndownChart(EstimationToolsBase, WikiMacroBase):
                 src="https://image-charts.com/chart?%s" % chart_args,
                 alt="Burndown Chart (client)")
 
-    def _calculate_timetable(self, options, query_args, req):
-        # create dictionary with entry for each day of the required time period
-        timetable = {}
-
-        current_date = options['startdate']
-        while current_date <= options['enddate']:
-            timetable[current_date] = Decimal(0)
-            current_date += timedelta(days=1)
+    def _chart_template(self, options):
+        """Returns the template of the chart parameters for the given options.
+
+        The parameters that only depend on the options are encoded once per
+        combination of options, the template has placeholders for the
+        parameters that depend on the chart data.
+        """
+        key = (options['width'], options['height'], options['bgcolor'],
+               options['color'], options['colorspent'],
+               options['colorexpected'])
+        template = _chart_templates.get(key)
+        if template is None:
+            if len(_chart_templates) >= CHART_TEMPLATES_SIZE:
+                _chart_templates.clear()
+            # a sequence of pairs keeps the parameters in a fixed order
+            template = Template(unicode_urlencode(
+                [('cht', 'lxy'),
+                 ('chs', '%sx%s' % (options['width'], options['height'])),
+                 ('chf', 'c,s,%s|bg,s,00000000' % options['bgcolor']),
+                 ('chco', '%s,%s,%s' % (options['color'],
+                                        options['colorspent'],
+                                        options['colorexpected'])),
+                 ('chdl', 'Remaining|Spent|Estimated'),
+                 ('chxt', 'x,x,y')]) +
+                # values are url-encoded, so they can't contain '$'
+                '&chtt=$chtt&chd=$chd&chxl=$chxl&chxr=$chxr&chg=$chg&chm=$chm')
+            _chart_templates[key] = template
+        return template
+
+    def _calculate_timetables(self, options, query_args, req):
+        """Calculates the remaining and the spent effort for each day of the
+        required time period, and returns both timetables as a tuple of lists
+        indexed by the day offset from the start date.
+        """
+        # create lists of the daily changes of the efforts, with entry for
+        # each day of the required time period (and one after it). These are
+        # kept in integer units of EFFORT_UNITS, so that adding up the
+        # changes is exact.
+        startdate = options['startdate']
+        enddate = options['enddate']
+        n_days = (enddate - startdate).days + 1
+        deltas = [0] * (n_days + 1)
+        deltas_spent = [0] * (n_days + 1)
 
         # get current values for all tickets within milestone and sprints
 
         query_args[self.remaining_field + "!"] = None
-        tickets = execute_query(self.env, req, query_args)
-
-        # add the open effort for each ticket for each day to the timetable
-
-        for t in tickets:
-
-            # Record the current (latest) status and estimate, and ticket
-            # creation date
-
-            creation_date = t['time'].date()
-            latest_status = t['status']
-            latest_estimate = self._cast_estimate(t[self.remaining_field])
-            if latest_estimate is None:
-                latest_estimate = Decimal(0)
-
-            # Fetch change history for status and effort fields for this ticket
-            # Build up two dictionaries, mapping dates when effort/status
-            # changed, to the latest effort/status on that day (in case of
-            # several changes on the same day). Also record the oldest known
-            # effort/status, i.e. that at the time of ticket creation
-
-            estimate_history = {}
-            status_history = {}
-
-            earliest_estimate = None
-            earliest_status = None
-
-            for row in self.env.db_query("""
-                    SELECT DISTINCT c.field AS field, c.time AS time,
-                                    c.oldvalue AS oldvalue, c.newvalue AS newvalue
-                    FROM ticket t, ticket_change c
-                    WHERE t.id = %s AND c.ticket = t.id AND
-                          (c.field=%s OR c.field='status')
-                    ORDER BY c.time ASC
-                    """, [t['id'], self.remaining_field]):
-                row_field, row_time, row_old, row_new = row
-                event_date = from_utimestamp(row_time).date()
-                if row_field == self.remaining_field:
-                    new_value = self._cast_estimate(row_new)
-                    if new_value is not None:
-                        estimate_history[event_date] = new_value
-                    if earliest_estimate is None:
-                        earliest_estimate = self._cast_estimate(row_old)
-                elif row_field == 'status':
-                    status_history[event_date] = row_new
-                    if earliest_status is None:
-                        earliest_status = row_old
-
-            # If we don't know already (i.e. the ticket effort/status was
-            # not changed on the creation date), set the effort on the
-            # creation date. It may be that we don't have an "earliest"
-            # estimate/status, because it was never changed. In this case,
-            # use the current (latest) value.
-
-            if creation_date not in estimate_history:
-                if earliest_estimate is not None:
-                    estimate_history[creation_date] = earliest_estimate
-                else:
-                    estimate_history[creation_date] = latest_estimate
-            if creation_date not in status_history:
-                if earliest_status is not None:
-                    status_history[creation_date] = earliest_status
-                else:
-                    status_history[creation_date] = latest_status
-
-            # Finally estimates to the timetable. Treat any period where the
-            # ticket was closed as estimate 0. We need to loop from ticket
-            # creation date, not just from the timetable start date, since
-            # it's possible that the ticket was changed between these two
-            # dates.
-
-            current_date = creation_date
-            current_estimate = None
-            is_open = None
-
-            while current_date <= options['enddate']:
-                if current_date in status_history:
-                    is_open = (
-                        status_history[current_date] not in self.closed_states)
-
-                if current_date in estimate_history:
-                    current_estimate = estimate_history[current_date]
-
-                if current_date >= options['startdate'] and is_open:
-                    timetable[current_date] += current_estimate
-
-                current_date += timedelta(days=1)
-
-        return timetable
-
-    def _calculate_timetable_spent(self, options, query_args, req):
-        # create dictionary with entry for each day of the required time period
-        timetable = {}
-
-        current_date = options['startdate']
-        while current_date <= options['enddate']:
-            timetable[current_date] = Decimal(0)
-            current_date += timedelta(days=1)
-
-        # get current values for all tickets within milestone and sprints
-
         query_args[self.spent_field + "!"] = None
         tickets = execute_query(self.env, req, query_args)
+        histories = self._get_histories(tickets)
 
-        # add the open effort for each ticket for each day to the timetable
+        # add the open effort and the spent effort for each ticket for each
+        # day to the timetables
 
-        for t in tickets:
-
-            # Record the current (latest) status and estimate, and ticket
-            # creation date
+        # bind attribute lookups once, outside of the loop over the tickets
+        closed_states = self._closed_states
+        by_day_offset = self._by_day_offset
+        to_units = self._to_units
 
+        for t in tickets:
             creation_date = t['time'].date()
-            latest_status = t['status']
-            latest_estimate = self._cast_estimate(t[self.spent_field])
-            if latest_estimate is None:
-                latest_estimate = Decimal(0)
-
-            # Fetch change history for status and effort fields for this ticket
-            # Build up two dictionaries, mapping dates when effort/status
-            # changed, to the latest effort/status on that day (in case of
-            # several changes on the same day). Also record the oldest known
-            # effort/status, i.e. that at the time of ticket creation
-
-            estimate_history = {}
-            status_history = {}
-
-            earliest_estimate = None
-            earliest_status = None
-
-            for row in self.env.db_query("""
-                    SELECT DISTINCT c.field AS field, c.time AS time,
-                                    c.oldvalue AS oldvalue, c.newvalue AS newvalue
-                    FROM ticket t, ticket_change c
-                    WHERE t.id = %s AND c.ticket = t.id AND
-                          (c.field=%s OR c.field='status')
-                    ORDER BY c.time ASC
-                    """, [t['id'], self.spent_field]):
-                row_field, row_time, row_old, row_new = row
-                event_date = from_utimestamp(row_time).date()
-                if row_field == self.spent_field:
-                    new_value = self._cast_estimate(row_new)
-                    if new_value is not None:
-                        estimate_history[event_date] = new_value
-                    if earliest_estimate is None:
-                        earliest_estimate = self._cast_estimate(row_old)
-                elif row_field == 'status':
-                    status_history[event_date] = row_new
-                    if earliest_status is None:
-                        earliest_status = row_old
-
-            # If we don't know already (i.e. the ticket effort/status was
-            # not changed on the creation date), set the effort on the
-            # creation date. It may be that we don't have an "earliest"
-            # estimate/status, because it was never changed. In this case,
-            # use the current (latest) value.
-
-            if creation_date not in estimate_history:
-                if earliest_estimate is not None:
-                    estimate_history[creation_date] = earliest_estimate
-                else:
-                    estimate_history[creation_date] = latest_estimate
-            if creation_date not in status_history:
-                if earliest_status is not None:
-                    status_history[creation_date] = earliest_status
-                else:
-                    status_history[creation_date] = latest_status
-
-            # Finally estimates to the timetable. We need to loop from ticket
-            # creation date, not just from the timetable start date, since
-            # it's possible that the ticket was changed between these two
-            # dates.
-
-            current_date = creation_date
-            current_estimate = None
-
-            while current_date <= options['enddate']:
-
-                if current_date in estimate_history:
-                    current_estimate = estimate_history[current_date]
-
-                if current_date >= options['startdate']:
-                    timetable[current_date] += current_estimate
-
-                current_date += timedelta(days=1)
-
+            if creation_date > enddate:
+                # the ticket didn't exist within the time period
+                continue
+            estimate_history, spent_history, status_history = \
+                histories[t['id']]
+
+            # Add estimates to the timetables. Treat any period where the
+            # ticket was closed as remaining estimate 0, spent effort is
+            # counted regardless of the status. The histories are converted
+            # to lists of day offsets from the timetable start date, which
+            # are negative for changes between ticket creation and the start
+            # date. Tickets that were closed for good before the start date
+            # have no remaining effort within the time period.
+
+            last_status_date = max(status_history)
+            if last_status_date >= startdate or \
+                    status_history[last_status_date] not in closed_states:
+                status_idx, status_open = by_day_offset(
+                    dict((date, status not in closed_states)
+                         for date, status in status_history.items()),
+                    startdate)
+                change_idx, change_est = by_day_offset(estimate_history,
+                                                       startdate)
+                walk_ticket(deltas, change_idx, to_units(change_est),
+                            status_idx, status_open)
+            change_idx, change_est = by_day_offset(spent_history, startdate)
+            walk_ticket(deltas_spent, change_idx, to_units(change_est),
+                        [(creation_date - startdate).days], [True])
+
+        return self._running_sum(deltas), self._running_sum(deltas_spent)
+
+    def _get_histories(self, tickets):
+        """Returns a dictionary mapping the ids of `tickets` to a tuple of
+        their remaining effort, spent effort and status histories, each a
+        dictionary mapping the dates of changes to the latest value on that
+        day.
+
+        The change history of a ticket is append-only, so the histories are
+        cached per ticket as long as its `changetime` is unchanged, and only
+        the history of new or changed tickets is fetched. At most
+        `HISTORY_CACHE_SIZE` histories are cached.
+        """
+        histories = {}
+        missing = {}
+        for t in tickets:
+            cached = self._history_cache.get(t['id'])
+            if cached is not None and cached[0] == t['changetime']:
+                histories[t['id']] = cached[1]
+            else:
+                missing[t['id']] = t
+
+        # build the histories while streaming the changes ticket by ticket,
+        # tickets without changes get their current values only. The field
+        # option descriptors are looked up once, instead of once per ticket
+        # and change.
+        fields = (self.remaining_field, self.spent_field)
+        built = {}
+        for tid, changes in self._fetch_changes(sorted(missing),
+                                                list(fields)):
+            built[tid] = self._build_histories(missing[tid], changes,
+                                               *fields)
+        cache = self._history_cache
+        for tid, t in missing.items():
+            if tid not in built:
+                built[tid] = self._build_histories(t, [], *fields)
+            # evict an arbitrary entry to stay within the cache size
+            if tid not in cache and len(cache) >= HISTORY_CACHE_SIZE:
+                cache.popitem()
+            cache[tid] = (t['changetime'], built[tid])
+        histories.update(built)
+
+        return histories
+
+    def _build_histories(self, t, changes, remaining_field, spent_field):
+        """Returns the remaining effort, spent effort and status histories of
+        ticket `t` from its `changes`, a list of `(field, time, oldvalue,
+        newvalue)` rows in chronological order.
+        """
+        cast_estimate = self._cast_estimate
+
+        # Record the current (latest) status and estimates, and ticket
+        # creation date
+
+        creation_date = t['time'].date()
+        latest_status = t['status']
+        latest_estimate = cast_estimate(t[remaining_field])
+        if latest_estimate is None:
+            latest_estimate = 0.0
+        latest_spent = cast_estimate(t[spent_field])
+        if latest_spent is None:
+            latest_spent = 0.0
+
+        # Walk the change history for status and effort fields for this
+        # ticket. Build up three dictionaries, mapping dates when
+        # remaining effort/spent effort/status changed, to the latest
+        # value on that day (in case of several changes on the same day).
+        # Also record the oldest known values, i.e. those at the time of
+        # ticket creation
+
+        estimate_history = {}
+        spent_history = {}
+        status_history = {}
+
+        earliest_estimate = None
+        earliest_spent = None
+        earliest_status = None
+
+        for row in changes:
+            row_field, row_time, row_old, row_new = row
+            event_date = from_utimestamp(row_time).date()
+            if row_field == remaining_field:
+                new_value = cast_estimate(row_new)
+                if new_value is not None:
+                    estimate_history[event_date] = new_value
+                if earliest_estimate is None:
+                    earliest_estimate = cast_estimate(row_old)
+            elif row_field == spent_field:
+                new_value = cast_estimate(row_new)
+                if new_value is not None:
+                    spent_history[event_date] = new_value
+                if earliest_spent is None:
+                    earliest_spent = cast_estimate(row_old)
+            elif row_field == 'status':
+                status_history[event_date] = row_new
+                if earliest_status is None:
+                    earliest_status = row_old
+
+        # If we don't know already (i.e. the ticket effort/status was
+        # not changed on the creation date), set the effort on the
+        # creation date. It may be that we don't have an "earliest"
+        # estimate/status, because it was never changed. In this case,
+        # use the current (latest) value.
+
+        if creation_date not in estimate_history:
+            if earliest_estimate is not None:
+                estimate_history[creation_date] = earliest_estimate
+            else:
+                estimate_history[creation_date] = latest_estimate
+        if creation_date not in spent_history:
+            if earliest_spent is not None:
+                spent_history[creation_date] = earliest_spent
+            else:
+                spent_history[creation_date] = latest_spent
+        if creation_date not in status_history:
+            if earliest_status is not None:
+                status_history[creation_date] = earliest_status
+            else:
+                status_history[creation_date] = latest_status
+
+        return estimate_history, spent_history, status_history
+
+    def _by_day_offset(self, history, startdate):
+        """Converts a dictionary mapping dates to values into two parallel
+        lists of day offsets from `startdate` (ascending) and values.
+        """
+        dates = sorted(history)
+        return ([(date - startdate).days for date in dates],
+                [history[date] for date in dates])
+
+    def _to_units(self, efforts):
+        # Efforts below the resolution of EFFORT_UNITS are rounded
+        return [int(round(effort * EFFORT_UNITS)) for effort in efforts]
+
+    def _running_sum(self, deltas):
+        """Returns the efforts per day from the daily changes in `deltas`."""
+        timetable = []
+        append = timetable.append
+        units = float(EFFORT_UNITS)
+        total = 0
+        for delta in deltas[:-1]:
+            total += delta
+            append(total / units)
         return timetable
 
-    def _scale_data(self, timetable, options):
-        # create sorted list of dates
-        dates = timetable.keys()
-        dates.sort()
-
-        maxhours = max(timetable.values() + [int(options.get('expected', 0))])
-
-        if maxhours <= Decimal(0):
-            maxhours = Decimal(100)
-        ydata = [str(self._round(timetable[d] * Decimal(100) / maxhours))
-                 for d in dates]
+    def _fetch_changes(self, ids, fields):
+        """Fetches the change history of the given `fields` and of the ticket
+        status for all tickets in `ids` at once. Generates a tuple of the
+        ticket id and the list of `(field, time, oldvalue, newvalue)` rows in
+        chronological order for each ticket that has changes.
+
+        The rows are streamed from the database, so only the changes of one
+        ticket are held in memory at a time.
+        """
+        # query in chunks to stay below the bound parameters limit of SQLite
+        for i in range(0, len(ids), CHANGES_CHUNK_SIZE):
+            chunk = ids[i:i + CHANGES_CHUNK_SIZE]
+            rows = iter_query(self.env, """
+                    SELECT c.ticket, c.field, c.time, c.oldvalue, c.newvalue
+                    FROM ticket_change c
+                    WHERE c.ticket IN (%s) AND
+                          c.field IN (%s, 'status')
+                    ORDER BY c.ticket, c.time ASC
+                    """ % (','.join(['%s'] * len(chunk)),
+                           ','.join(['%s'] * len(fields))),
+                    chunk + fields)
+            for tid, group in groupby(rows, itemgetter(0)):
+                yield tid, [row[1:] for row in group]
+
+    def _scale_data(self, timetable, dates, options):
+        # float division, also for an integer timetable and expected value
+        maxhours = max(max(timetable or [0]),
+                       float(options.get('expected', 0)))
+
+        if maxhours <= 0:
+            maxhours = 100.0
+
+        # only scale the days up to today, mark ydata invalid that is after
+        # today (dates are sorted)
+        n_valid = bisect_right(dates, options['today'])
+        ydata = [str(self._round(hours * 100 / maxhours))
+                 for hours in timetable[:n_valid]]
+        ydata += ['-1'] * (len(dates) - n_valid)
         xdata = [str(self._round(x * Decimal(100) / (len(dates) - 1)))
                  for x in range(len(dates))]
 
-        # mark ydata invalid that is after today
-        remaining_days = len([d for d in dates if d > options['today']])
-        if remaining_days:
-            ydata = ydata[: - remaining_days] + ['-1' for x in
-                                                 xrange(0, remaining_days)]
-
         return xdata, ydata, maxhours
 
-    def _round(self, decimal_):
-        return decimal_.quantize(Decimal("0.01"), ROUND_HALF_UP)
+    def _round(self, value):
+        # Round half up to two decimal places. Floats are converted to
+        # Decimal using their shortest representation.
+        if not isinstance(value, Decimal):
+            value = Decimal(repr(value))
+        return value.quantize(Decimal("0.01"), ROUND_HALF_UP)
 
     def _cast_estimate(self, estimate):
         # Treat 0, empty string or None as 0.0
         if not estimate:
-            return Decimal(0)
+            return 0.0
         try:
-            return Decimal(estimate)
-        except (TypeError, ValueError, InvalidOperation):
+            return float(estimate)
+        except (TypeError, ValueError):
             # Treat other incorrect values as None
             return None
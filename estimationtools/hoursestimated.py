@@ -6,10 +6,13 @@
 # This software is licensed as described in the file COPYING, which
 # you should have received as part of this distribution.
 
+import math
+
 from trac.wiki.api import parse_args
 from trac.wiki.macros import WikiMacroBase
 
-from estimationtools.utils import EstimationToolsBase, execute_query
+from estimationtools.utils import EstimationToolsBase, execute_query, \
+                                  safe_float
 
 
 class HoursEstimated(EstimationToolsBase, WikiMacroBase):
@@ -34,11 +37,7 @@ class HoursEstimated(EstimationToolsBase, WikiMacroBase):
 
         tickets = execute_query(self.env, req, options)
 
-        sum = 0.0
-        for t in tickets:
-            try:
-                sum += float(t[self.estimation_field])
-            except:
-                pass
+        field = self.estimation_field
+        total = math.fsum(safe_float(t[field]) for t in tickets)
 
-        return "%g" % round(sum, 2)
+        return "%g" % round(total, 2)
@@ -7,7 +7,6 @@
 # you should have received as part of this distribution.
 
 import unittest
-from decimal import Decimal
 from datetime import datetime, timedelta
 
 from genshi.builder import QName
@@ -16,7 +15,8 @@ from trac.ticket.model import Ticket
 from trac.util.datefmt import utc
 from trac.web.href import Href
 
-from estimationtools.burndownchart import BurndownChart
+from estimationtools import burndownchart
+from estimationtools.burndownchart import BurndownChart, walk_ticket
 from estimationtools.utils import parse_options, urldecode
 
 
@@ -44,9 +44,7 @@ class BurndownChartTestCase(unittest.TestCase):
 
     def _change_ticket_estimations(self, id, history):
         ticket = Ticket(self.env, id)
-        keys = history.keys()
-        keys.sort()
-        for key in keys:
+        for key in sorted(history):
             ticket['hours_remaining'] = history[key]
             ticket.save_changes("me", "testing",
                                 datetime.combine(key,
@@ -54,9 +52,7 @@ class BurndownChartTestCase(unittest.TestCase):
 
     def _change_ticket_states(self, id, history):
         ticket = Ticket(self.env, id)
-        keys = history.keys()
-        keys.sort()
-        for key in keys:
+        for key in sorted(history):
             ticket['status'] = history[key]
             ticket.save_changes("me", "testing",
                                 datetime.combine(key,
@@ -82,14 +78,17 @@ class BurndownChartTestCase(unittest.TestCase):
         chart = BurndownChart(self.env)
         str = "milestone=milestone1, startdate=2008-02-20, enddate=2008-02-28"
         options, query_args = parse_options(self.env, str, {})
-        timetable = chart._calculate_timetable(options, query_args, self.req)
-        xdata, ydata, maxhours = chart._scale_data(timetable, options)
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
+        dates = [options['startdate'] + timedelta(days=i)
+                 for i in range(len(timetable))]
+        xdata, ydata, maxhours = chart._scale_data(timetable, dates, options)
         self.assertEqual(xdata,
                          ['0.00', '12.50', '25.00', '37.50', '50.00', '62.50',
                           '75.00', '87.50', '100.00'])
         self.assertEqual(ydata, ['0.00', '0.00', '0.00', '0.00', '0.00', '0.00',
                                  '0.00', '0.00', '0.00'])
-        self.assertEqual(maxhours, Decimal(100))
+        self.assertEqual(maxhours, 100.0)
 
     def test_build_zero_day_chart(self):
         chart = BurndownChart(self.env)
@@ -106,9 +105,9 @@ class BurndownChartTestCase(unittest.TestCase):
                    'closedstates': ['closed']}
         query_args = {'milestone': "milestone1"}
         self._insert_ticket('10')
-        timetable = chart._calculate_timetable(options, query_args, self.req)
-        self.assertEqual(timetable, {day1: Decimal(10), day2: Decimal(10),
-                                     day3: Decimal(10)})
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
+        self.assertEqual(timetable, [10.0, 10.0, 10.0])
 
     def test_calculate_timetable_without_milestone(self):
         chart = BurndownChart(self.env)
@@ -118,9 +117,8 @@ class BurndownChartTestCase(unittest.TestCase):
         options = {'today': day3, 'startdate': day1, 'enddate': day3,
                    'closedstates': ['closed']}
         self._insert_ticket('10')
-        timetable = chart._calculate_timetable(options, {}, self.req)
-        self.assertEqual(timetable, {day1: Decimal(10), day2: Decimal(10),
-                                     day3: Decimal(10)})
+        timetable = chart._calculate_timetables(options, {}, self.req)[0]
+        self.assertEqual(timetable, [10.0, 10.0, 10.0])
 
     def test_calculate_timetable_with_simple_changes(self):
         chart = BurndownChart(self.env)
@@ -133,9 +131,9 @@ class BurndownChartTestCase(unittest.TestCase):
         ticket1 = self._insert_ticket('10')
         self._change_ticket_estimations(ticket1, {day2: '5', day3: '0'})
 
-        timetable = chart._calculate_timetable(options, query_args, self.req)
-        self.assertEqual(timetable, {day1: Decimal(10), day2: Decimal(5),
-                                     day3: Decimal(0)})
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
+        self.assertEqual(timetable, [10.0, 5.0, 0.0])
 
     def test_calculate_timetable_with_closed_ticket(self):
         chart = BurndownChart(self.env)
@@ -148,9 +146,9 @@ class BurndownChartTestCase(unittest.TestCase):
         ticket1 = self._insert_ticket('10')
         self._change_ticket_estimations(ticket1, {day2: '5'})
         self._change_ticket_states(ticket1, {day3: 'closed'})
-        timetable = chart._calculate_timetable(options, query_args, self.req)
-        self.assertEqual(timetable, {day1: Decimal(10), day2: Decimal(5),
-                                     day3: Decimal(0)})
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
+        self.assertEqual(timetable, [10.0, 5.0, 0.0])
 
     def test_calculate_timetable_with_closed_ticket2(self):
         chart = BurndownChart(self.env)
@@ -163,9 +161,9 @@ class BurndownChartTestCase(unittest.TestCase):
         ticket1 = self._insert_ticket('10')
         self._change_ticket_states(ticket1, {day2: 'closed'})
         self._change_ticket_estimations(ticket1, {day3: '5'})
-        timetable = chart._calculate_timetable(options, query_args, self.req)
-        self.assertEqual(timetable, {day1: Decimal(10), day2: Decimal(0),
-                                     day3: Decimal(0)})
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
+        self.assertEqual(timetable, [10.0, 0.0, 0.0])
 
     def test_calculate_timetable_with_closed_and_reopened_ticket(self):
         chart = BurndownChart(self.env)
@@ -179,10 +177,43 @@ class BurndownChartTestCase(unittest.TestCase):
         ticket1 = self._insert_ticket('10')
         self._change_ticket_estimations(ticket1, {day3: '5'})
         self._change_ticket_states(ticket1, {day2: 'closed', day4: 'new'})
-        timetable = chart._calculate_timetable(options, query_args, self.req)
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
         self.assertEqual(timetable,
-                         {day1: Decimal(10), day2: Decimal(0), day3: Decimal(0),
-                          day4: Decimal(5)})
+                         [10.0, 0.0, 0.0, 5.0])
+
+    def test_calculate_timetable_with_ticket_closed_before_start(self):
+        chart = BurndownChart(self.env)
+        day1 = datetime.now(utc).date()
+        day2 = day1 + timedelta(days=1)
+        day3 = day2 + timedelta(days=1)
+        day4 = day3 + timedelta(days=1)
+        options = {'today': day4, 'startdate': day3, 'enddate': day4,
+                   'closedstates': ['closed']}
+        query_args = {'milestone': "milestone1"}
+        ticket1 = self._insert_ticket('10')
+        self._change_ticket_states(ticket1, {day2: 'closed'})
+        self._insert_ticket('5')
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
+        self.assertEqual(timetable, [5.0, 5.0])
+
+    def test_calculate_timetable_with_changes_after_end(self):
+        chart = BurndownChart(self.env)
+        day1 = datetime.now(utc).date()
+        day2 = day1 + timedelta(days=1)
+        day3 = day2 + timedelta(days=1)
+        day4 = day3 + timedelta(days=1)
+        day5 = day4 + timedelta(days=1)
+        options = {'today': day5, 'startdate': day1, 'enddate': day2,
+                   'closedstates': ['closed']}
+        query_args = {'milestone': "milestone1"}
+        ticket1 = self._insert_ticket('10')
+        self._change_ticket_estimations(ticket1, {day4: '5'})
+        self._change_ticket_states(ticket1, {day5: 'closed'})
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
+        self.assertEqual(timetable, [10.0, 10.0])
 
     def test_calculate_timetable_with_simple_changes_2(self):
         chart = BurndownChart(self.env)
@@ -197,9 +228,9 @@ class BurndownChartTestCase(unittest.TestCase):
         ticket2 = self._insert_ticket('0')
         self._change_ticket_estimations(ticket2, {day2: '1', day3: '2'})
 
-        timetable = chart._calculate_timetable(options, query_args, self.req)
-        self.assertEqual(timetable, {day1: Decimal(10), day2: Decimal(6),
-                                     day3: Decimal(2)})
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
+        self.assertEqual(timetable, [10.0, 6.0, 2.0])
 
     def test_calculate_timetable_with_recent_changes(self):
         chart = BurndownChart(self.env)
@@ -213,9 +244,9 @@ class BurndownChartTestCase(unittest.TestCase):
         ticket1 = self._insert_ticket('10')
         self._change_ticket_estimations(ticket1, {day2: '5', day4: ''})
 
-        timetable = chart._calculate_timetable(options, query_args, self.req)
-        self.assertEqual(timetable, {day1: Decimal(10), day2: Decimal(5),
-                                     day3: Decimal(5)})
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
+        self.assertEqual(timetable, [10.0, 5.0, 5.0])
 
     def test_calculate_timetable_with_gibberish_estimates(self):
         chart = BurndownChart(self.env)
@@ -227,9 +258,61 @@ class BurndownChartTestCase(unittest.TestCase):
         query_args = {'milestone': "milestone1"}
         ticket1 = self._insert_ticket('10')
         self._change_ticket_estimations(ticket1, {day2: 'IGNOREME', day3: '5'})
-        timetable = chart._calculate_timetable(options, query_args, self.req)
-        self.assertEqual({day1: Decimal(10), day2: Decimal(10),
-                          day3: Decimal(5)}, timetable)
+        timetable = chart._calculate_timetables(options, query_args,
+                                                self.req)[0]
+        self.assertEqual([10.0, 10.0, 5.0], timetable)
+
+    def test_calculate_timetable_with_cached_history(self):
+        chart = BurndownChart(self.env)
+        day1 = datetime.now(utc).date()
+        day2 = day1 + timedelta(days=1)
+        day3 = day2 + timedelta(days=1)
+        options = {'today': day3, 'startdate': day1, 'enddate': day3,
+                   'closedstates': ['closed']}
+        query_args = {'milestone': "milestone1"}
+        ticket1 = self._insert_ticket('10')
+        timetable = chart._calculate_timetables(options, dict(query_args),
+                                                self.req)[0]
+        self.assertEqual(timetable, [10.0, 10.0, 10.0])
+        # changing the ticket invalidates its cached history
+        self._change_ticket_estimations(ticket1, {day2: '5'})
+        timetable = chart._calculate_timetables(options, dict(query_args),
+                                                self.req)[0]
+        self.assertEqual(timetable, [10.0, 5.0, 5.0])
+
+    def test_calculate_timetable_with_full_history_cache(self):
+        chart = BurndownChart(self.env)
+        day1 = datetime.now(utc).date()
+        day2 = day1 + timedelta(days=1)
+        options = {'today': day2, 'startdate': day1, 'enddate': day2,
+                   'closedstates': ['closed']}
+        query_args = {'milestone': "milestone1"}
+        for estimation in ('1', '2', '4'):
+            self._insert_ticket(estimation)
+        cache_size = burndownchart.HISTORY_CACHE_SIZE
+        burndownchart.HISTORY_CACHE_SIZE = 2
+        try:
+            for i in range(2):
+                timetable = chart._calculate_timetables(
+                    options, dict(query_args), self.req)[0]
+                self.assertEqual(timetable, [7.0, 7.0])
+                self.assertEqual(len(chart._history_cache), 2)
+        finally:
+            burndownchart.HISTORY_CACHE_SIZE = cache_size
+
+    def test_walk_ticket(self):
+        deltas = [0] * 7
+        # created 2 days before the timetable starts, estimate changed on
+        # day 1 and day 4, closed on day 2 and reopened on day 5
+        walk_ticket(deltas, [-2, 1, 4], [8, 5, 3],
+                    [-2, 2, 5], [True, False, True])
+        self.assertEqual(deltas, [8, -3, -5, 0, 0, 3, -3])
+
+    def test_walk_ticket_with_changes_after_last_day(self):
+        deltas = [0] * 4
+        # re-estimated and closed after the end of the timetable
+        walk_ticket(deltas, [-1, 5], [10, 0], [-1, 6], [True, False])
+        self.assertEqual(deltas, [10, 0, 0, -10])
 
     def test_url_encode(self):
         start = datetime.now(utc).date()
@@ -304,15 +387,23 @@ class BurndownChartTestCase(unittest.TestCase):
         day6 = day1 + timedelta(days=5)
         day7 = day1 + timedelta(days=6)
         options = {'startdate': day1, 'enddate': day7, 'today': day7}
-        timetable = {day1: Decimal(70), day2: Decimal(60), day3: Decimal(50),
-                     day4: Decimal(40), day5: Decimal(30), day6: Decimal(20),
-                     day7: Decimal(10)}
-        self.assertEquals(chart._scale_data(timetable, options),
+        dates = [day1, day2, day3, day4, day5, day6, day7]
+        timetable = [70.0, 60.0, 50.0, 40.0, 30.0, 20.0, 10.0]
+        self.assertEquals(chart._scale_data(timetable, dates, options),
                           (['0.00', '16.67', '33.33', '50.00', '66.67', '83.33',
                             '100.00'],
                            ['100.00', '85.71', '71.43', '57.14', '42.86',
                             '28.57', '14.29'],
-                           Decimal('70')))
+                           70.0))
+
+    def test_scale_fractional_expected(self):
+        chart = BurndownChart(self.env)
+        day1 = datetime.now(utc).date()
+        day2 = day1 + timedelta(days=1)
+        options = {'startdate': day1, 'enddate': day2, 'today': day1,
+                   'expected': '12.5'}
+        self.assertEquals(chart._scale_data([10, 5], [day1, day2], options),
+                          (['0.00', '100.00'], ['80.00', '-1'], 12.5))
 
     def test_scale_no_weekends(self):
         chart = BurndownChart(self.env)
@@ -327,12 +418,12 @@ class BurndownChartTestCase(unittest.TestCase):
         day7 = day1 + timedelta(days=6)
         options = {'startdate': day1, 'enddate': day7, 'today': day7}
         # no weekends option, so day6 and day7 not included
-        timetable = {day1: Decimal(70), day2: Decimal(60), day3: Decimal(50),
-                     day4: Decimal(40), day5: Decimal(30)}
-        self.assertEquals(chart._scale_data(timetable, options),
+        dates = [day1, day2, day3, day4, day5]
+        timetable = [70.0, 60.0, 50.0, 40.0, 30.0]
+        self.assertEquals(chart._scale_data(timetable, dates, options),
                           (['0.00', '25.00', '50.00', '75.00', '100.00'],
                            ['100.00', '85.71', '71.43', '57.14', '42.86'],
-                           Decimal('70')))
+                           70.0))
 
 
 def suite():
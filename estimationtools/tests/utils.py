@@ -7,9 +7,12 @@
 # you should have received as part of this distribution.
 
 import unittest
+from datetime import date, timedelta
+
 from trac.test import EnvironmentStub, Mock
 
-from estimationtools.utils import EstimationToolsBase
+from estimationtools.utils import EstimationToolsBase, count_workdays, \
+                                  safe_float
 
 
 class EstimationToolsBaseTestCase(unittest.TestCase):
@@ -42,8 +45,32 @@ class EstimationToolsBaseTestCase(unittest.TestCase):
         self.assertEquals(messages, [])
 
 
+class UtilsTestCase(unittest.TestCase):
+    def test_count_workdays(self):
+        # compare with counting day by day, for all weekdays and ranges of
+        # up to three weeks
+        monday = date(2008, 1, 7)
+        for start in [monday + timedelta(days=i) for i in range(7)]:
+            for length in range(-1, 22):
+                end = start + timedelta(days=length)
+                expected = len([i for i in range(length + 1)
+                                if (start + timedelta(days=i)).weekday() < 5])
+                self.assertEquals((start, end, expected),
+                                  (start, end, count_workdays(start, end)))
+
+    def test_safe_float(self):
+        self.assertEquals(10.5, safe_float('10.5'))
+        self.assertEquals(0.0, safe_float(''))
+        self.assertEquals(0.0, safe_float(None))
+        self.assertEquals(0.0, safe_float('xxx'))
+        self.assertEquals(None, safe_float('xxx', None))
+
+
 def suite():
-    return unittest.makeSuite(EstimationToolsBaseTestCase)
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(EstimationToolsBaseTestCase))
+    suite.addTest(unittest.makeSuite(UtilsTestCase))
+    return suite
 
 
 if __name__ == '__main__':
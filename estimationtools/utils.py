@@ -188,6 +188,25 @@ def execute_query(env, req, query_args):
     return tickets
 
 
+def iter_query(env, sql, args=None, arraysize=1000):
+    """Executes a SELECT query and generates the resulting rows.
+
+    Unlike `env.db_query`, the result is not fetched at once but in chunks
+    of `arraysize` rows, so large results don't need to be held in memory.
+    The rows should be consumed promptly, as the database connection is kept
+    until the generator is exhausted or closed.
+    """
+    with env.db_query as db:
+        cursor = db.cursor()
+        cursor.execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(arraysize)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+
 def parse_bool(s):
     if s is True or s is False:
         return s
@@ -195,6 +214,28 @@ def parse_bool(s):
     return s not in ['false', 'f', 'n', '0', '']
 
 
+def count_workdays(start, end):
+    """Returns the number of workdays (Monday to Friday) from `start` to
+    `end`, both inclusive.
+    """
+    days = (end - start).days + 1
+    if days <= 0:
+        return 0
+    weeks, rest = divmod(days, 7)
+    weekday = start.weekday()
+    return weeks * 5 + len([i for i in xrange(rest) if (weekday + i) % 7 < 5])
+
+
+def safe_float(value, default=0.0):
+    """Converts `value` to float, returns `default` for values that are not
+    a number (e.g. empty or invalid estimations).
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
 def urldecode(query):
     # Adapted from example on Python mailing lists
     d = {}
@@ -7,16 +7,17 @@
 # you should have received as part of this distribution.
 
 import copy
-from datetime import timedelta
+from collections import defaultdict
 
+from trac.util import lazy
 from trac.util.html import html as tag
 from trac.util.text import unicode_quote, unicode_urlencode, \
     obfuscate_email_address
 from trac.wiki.macros import WikiMacroBase
 
 from estimationtools.utils import parse_options, execute_query, \
-    get_estimation_suffix, get_closed_states, \
-    get_serverside_charts, EstimationToolsBase
+    count_workdays, get_estimation_suffix, get_closed_states, \
+    get_serverside_charts, safe_float, EstimationToolsBase
 
 DEFAULT_OPTIONS = {'width': '400', 'height': '100', 'color': 'ff9900'}
 
@@ -46,6 +47,10 @@ class WorkloadChart(EstimationToolsBase, WikiMacroBase):
     closed_states = get_closed_states()
     serverside_charts = get_serverside_charts()
 
+    @lazy
+    def _closed_states(self):
+        return frozenset(self.closed_states)
+
     def expand_macro(self, formatter, name, content, args=None):
         req = formatter.req
         # prepare options
@@ -55,21 +60,18 @@ class WorkloadChart(EstimationToolsBase, WikiMacroBase):
         query_args[self.remaining_field + "!"] = None
         tickets = execute_query(self.env, req, query_args)
 
-        sum = 0.0
-        estimations = {}
+        total = 0.0
+        estimations = defaultdict(float)
+        closed_states = self._closed_states
+        field = self.remaining_field
         for ticket in tickets:
-            if ticket['status'] in self.closed_states:
+            if ticket['status'] in closed_states:
+                continue
+            estimation = safe_float(ticket[field], None)
+            if estimation is None:
                 continue
-            try:
-                estimation = float(ticket[self.remaining_field])
-                owner = ticket['owner']
-                sum += estimation
-                if owner in estimations:
-                    estimations[owner] += estimation
-                else:
-                    estimations[owner] = estimation
-            except:
-                pass
+            estimations[ticket['owner']] += estimation
+            total += estimation
 
         estimations_string = []
         labels = []
@@ -87,14 +89,9 @@ class WorkloadChart(EstimationToolsBase, WikiMacroBase):
 
         # calculate remaining work time
         if options.get('today') and options.get('enddate'):
-            currentdate = options['today']
-            day = timedelta(days=1)
-            days_remaining = 0
-            while currentdate <= options['enddate']:
-                if currentdate.weekday() < 5:
-                    days_remaining += 1
-                currentdate += day
-            title += ' %g%s (~%s workdays left)' % (round(sum, 2),
+            days_remaining = count_workdays(options['today'],
+                                            options['enddate'])
+            title += ' %g%s (~%s workdays left)' % (round(total, 2),
                                                     self.estimation_suffix,
                                                     days_remaining)
 